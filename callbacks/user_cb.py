@@ -1,42 +1,88 @@
+import asyncio
+import io
 import os
+import tempfile
 import aiohttp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.types.input_file import FSInputFile
 import librosa
 import numpy as np
+import soundfile as sf
 from keyboards import builders
 from config_reader import config
 from yandex import YandexMusicSDK
 from handlers import cmds
+from handlers.sim import mfcc_summary
 
 
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from orm.db import User, Track, AsyncSessionLocal
 
 router = Router()
 
-async def get_or_create_user(username: str, chat_id: int) -> User:
+# Пул процессов для librosa создаётся в main.py; пока он не задан, работает стандартный пул потоков
+mfcc_pool: ProcessPoolExecutor | None = None
+
+USER_CACHE_SIZE = 1024
+# username -> users.id: при повторных загрузках upsert пользователя пропускается
+_user_ids: OrderedDict[str, int] = OrderedDict()
+
+async def get_or_create_user_id(session: AsyncSession, username: str, chat_id: int) -> int:
+    """id пользователя с блокировкой его строки до конца транзакции.
+
+    Блокировка сериализует параллельные загрузки одного пользователя: иначе каждая
+    пересчитает профиль только со своим незакоммиченным треком и перезапишет чужой.
+    """
+    user_id = _user_ids.get(username)
+    if user_id is not None:
+        # Кэш избавляет от upsert, но не от его блокировки строки
+        locked = await session.execute(select(User.id).where(User.id == user_id).with_for_update())
+        if locked.scalar_one_or_none() is not None:
+            _user_ids.move_to_end(username)
+            return user_id
+        del _user_ids[username]  # Строку удалили (например, reset_database): создаём заново
+
+    result = await session.execute(
+        insert(User)
+        .values(username=username, chat_id=chat_id)
+        .on_conflict_do_update(index_elements=[User.username], set_={"chat_id": chat_id})
+        .returning(User.id)
+    )
+    return result.scalar_one()
+
+def remember_user_id(username: str, user_id: int):
+    _user_ids[username] = user_id
+    _user_ids.move_to_end(username)
+    if len(_user_ids) > USER_CACHE_SIZE:
+        _user_ids.popitem(last=False)
+
+
+async def add_track_to_db(
+    username: str, chat_id: int, title: str, artist: str, mfcc: bytes, n_frames: int, mfcc_mean: bytes, mfcc_var: bytes
+) -> int:
+    """Одной транзакцией: пользователь, трек, пересчёт профиля и новое количество треков."""
+    print(f"Добавляю трек: {title} | {artist} | {len(mfcc)} байт")
     async with AsyncSessionLocal() as session:
         async with session.begin():
-            result = await session.execute(select(User).filter_by(username=username))
-            user = result.scalars().first()
-            if not user:
-                user = User(username=username, chat_id=chat_id)  # <-- Добавили chat_id
-                session.add(user)
-                await session.commit()
-        return user
+            user_id = await get_or_create_user_id(session, username, chat_id)
+            session.add(Track(
+                user_id=user_id, title=title, artist=artist,
+                mfcc=mfcc, n_frames=n_frames, mfcc_mean=mfcc_mean, mfcc_var=mfcc_var,
+            ))
 
+            await cmds.save_user_profile(session, user_id)
 
-async def add_track_to_db(user_id: int, title: str, artist: str, mfcc: bytes):
-    print(f"Добавляю трек: {title} | {artist} | {len(mfcc)} байт")
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            track = Track(user_id=user_id, title=title, artist=artist, mfcc=mfcc)
-            session.add(track)
-        await session.commit()
+            result = await session.execute(select(func.count()).where(Track.user_id == user_id))
+            track_count = result.scalar() or 0
+    remember_user_id(username, user_id)  # Кэшируем только после успешного коммита
+    return track_count
 
 
 @router.callback_query(F.data == 'song')
@@ -49,23 +95,50 @@ async def show_song(query: CallbackQuery) -> None:
     await query.answer('Чтобы узнать свой мэтч с другим /match @username!', reply_markup=builders.inline_builder(['Назад'], ['main_page']))
     await query.answer()
 
-async def extract_mfcc(file_path: str) -> bytes:
-    y, sr = librosa.load(file_path, sr=None)
-    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20)
-    return np.array(mfcc).tobytes()  # Преобразуем в байты
+def _load_audio(source: str | bytes) -> tuple[np.ndarray, int]:
+    """Читаем аудио (путь или байты) через soundfile сразу в float32 моно; librosa — запасной путь для неподдерживаемых кодеков."""
+    try:
+        y, sr = sf.read(io.BytesIO(source) if isinstance(source, bytes) else source, dtype='float32')
+    except sf.LibsndfileError:
+        if isinstance(source, str):
+            return librosa.load(source, sr=None)
+        # librosa уходит в audioread только для путей, файловые объекты он не декодирует:
+        # байты, которые не открыл libsndfile (MP3 до 1.1), отдаём ему через временный файл
+        with tempfile.NamedTemporaryFile(suffix=".mp3", delete_on_close=False) as tmp:
+            tmp.write(source)
+            tmp.close()
+            return librosa.load(tmp.name, sr=None)
+    if y.ndim == 2:
+        y = y.mean(axis=1)  # Сводим каналы в моно, как это делает librosa.load
+    return np.ascontiguousarray(y), sr
+
+def _extract_mfcc_sync(source: str | bytes) -> tuple[bytes, int, bytes, bytes]:
+    """Тяжёлая часть на librosa: выполняется в воркере, наружу отдаёт только байты."""
+    y, sr = _load_audio(source)
+    # float32 в C-порядке: байты один в один читаются через np.frombuffer(..., dtype=np.float32)
+    mfcc = np.ascontiguousarray(librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20), dtype=np.float32)
+    # Сводка по фреймам считается один раз при загрузке, /match читает только её (по 80 байт)
+    mfcc_mean, mfcc_var = mfcc_summary(mfcc)
+    return mfcc.tobytes(), mfcc.shape[1], mfcc_mean.tobytes(), mfcc_var.tobytes()  # Преобразуем в байты
+
+async def extract_mfcc(source: str | bytes) -> tuple[bytes, int, bytes, bytes]:
+    """Считает MFCC (из файла или из байтов) вне event loop, чтобы не блокировать остальных пользователей."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(mfcc_pool, _extract_mfcc_sync, source)
 
 @router.callback_query(F.data.startswith("confirm:"))
-async def delete_song_callback(query: CallbackQuery) -> None:
+async def delete_song_callback(query: CallbackQuery, sdk: YandexMusicSDK) -> None:
     name = query.data.split("confirm:")[1]
-    async with YandexMusicSDK(token=config.access_token.get_secret_value(), upload_dir="downloads") as sdk:
-        tracks = await sdk.search_tracks(name, count=1, download=True, lyrics=False)
-
-        for track in tracks:
-            user = await get_or_create_user(query.from_user.username, query.from_user.id)  # <-- Теперь передаем chat_id
-            mfcc = await extract_mfcc(track.file_path)  #! Вычисляем MFCC
-            await add_track_to_db(user.id, track.title, track.artists[0], mfcc)
-            track_count = await cmds.get_user_track_count(user.id)
-            await query.message.edit_text(f'✔ {track.title} успешно добавлено в вашу медиатеку! ({track_count})')
+    # По умолчанию трек скачивается в память и не проходит через диск
+    tracks = await sdk.search_tracks(name, count=1, download=True, lyrics=False, in_memory=not config.KEEP_DOWNLOADS)
+
+    for track in tracks:
+        mfcc, n_frames, mfcc_mean, mfcc_var = await extract_mfcc(track.file_path or track.audio)  #! Вычисляем MFCC
+        track_count = await add_track_to_db(
+            query.from_user.username, query.from_user.id, track.title, track.artists[0],
+            mfcc, n_frames, mfcc_mean, mfcc_var,
+        )
+        await query.message.edit_text(f'✔ {track.title} успешно добавлено в вашу медиатеку! ({track_count})')
 
 @router.callback_query(F.data == "del")
 async def del_(query: CallbackQuery):
@@ -10,6 +10,9 @@ class Settings(BaseSettings):
     access_token: SecretStr
     BOT_TOKEN: SecretStr
     ADMIN_ID: int
+    SQL_ECHO: bool = False  # Логировать каждый SQL-запрос (только для отладки)
+    REDIS_URL: str = "redis://localhost:6379/0"  # Кэш file_id и метаданных треков
+    KEEP_DOWNLOADS: bool = False  # Сохранять загруженные треки в downloads/ вместо обработки в памяти
 
     @property
     def DATABASE_URL_asyncpg(self):
@@ -6,30 +6,37 @@ from config_reader import config
 from keyboards import builders
 from yandex import YandexMusicSDK
 from orm.db import AsyncSessionLocal, User, Track  
-from sqlalchemy import func
+from sqlalchemy import func, text, update
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from handlers.sim import mfcc_summary, normalize40, reduce_profile
 
 router = Router()
 
-async def get_user_by_chat_id(chat_id: int):
-    """Получаем объект User по chat_id."""
+async def get_user_id_by_chat_id(chat_id: int) -> int | None:
+    """Получаем id пользователя по chat_id (без загрузки ORM-объекта)."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.chat_id == chat_id))
-        return result.scalars().first()
+        result = await session.execute(select(User.id).where(User.chat_id == chat_id))
+        return result.scalar_one_or_none()
 
-async def get_user_by_username(username: str):
-    """Получаем объект User по username."""
+async def get_user_id_by_username(username: str) -> int | None:
+    """Получаем id пользователя по username (без загрузки ORM-объекта)."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(User).where(User.username == username))
-        return result.scalars().first()
+        result = await session.execute(select(User.id).where(User.username == username))
+        return result.scalar_one_or_none()
+
+def select_user_tracks(user_id: int):
+    """Запрос средних MFCC треков пользователя (профилю нужны только они и артист)."""
+    return (
+        select(Track.mfcc_mean, Track.artist)
+        .where(Track.user_id == user_id, Track.mfcc_mean.is_not(None))
+    )
 
 async def get_user_tracks(user_id: int):
-    """Получаем MFCC-треки пользователя."""
+    """Получаем MFCC-сводки треков пользователя."""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Track.mfcc, Track.artist).where(Track.user_id == user_id))
-        return result.fetchall()  # [(mfcc, artist), ...]
+        result = await session.execute(select_user_tracks(user_id))
+        return result.fetchall()  # [(mfcc_mean, artist), ...]
     
 async def get_user_track_count(user_id: int) -> int:
     """Возвращает количество треков пользователя."""
@@ -53,26 +60,83 @@ async def get_user_track_count(user_id: int) -> int:
 def calculate_mean_mfcc(tracks):
     """Вычисляет усредненный MFCC-вектор + дисперсию, чтобы учитывать разнообразие."""
     if not tracks:
-        return np.zeros(40)  # Удваиваем размерность (среднее + дисперсия)
-
-    artist_mfcc = {}
-    for mfcc, artist in tracks:
-        mfcc_vector = np.frombuffer(mfcc, dtype=np.float32).reshape(20, -1).mean(axis=1)
-        artist_mfcc.setdefault(artist, []).append(mfcc_vector)
-
-    mean_vectors = [np.mean(vectors, axis=0) for vectors in artist_mfcc.values()]
-    var_vectors = [np.var(vectors, axis=0) for vectors in artist_mfcc.values()]
-
-    mean_mfcc = np.mean(mean_vectors, axis=0) if mean_vectors else np.zeros(20)
-    var_mfcc = np.mean(var_vectors, axis=0) if var_vectors else np.zeros(20)
-
-    return np.concatenate([mean_mfcc, var_mfcc])  # Вектор размером 40
+        return np.zeros(40, dtype=np.float32)  # Удваиваем размерность (среднее + дисперсия)
+
+    # Средние уже посчитаны при загрузке трека: склеиваем их в матрицу (треки x 20) без копий по одной
+    means = np.frombuffer(b"".join(row[0] for row in tracks), dtype=np.float32).reshape(len(tracks), 20)
+    ids = {}
+    artist_ids = np.array([ids.setdefault(row[1], len(ids)) for row in tracks], dtype=np.int32)
+
+    return reduce_profile(means, artist_ids, len(ids))  # Вектор размером 40
+
+def warm_up():
+    """Компилирует (или поднимает из кэша) numba-ядра до первого запроса пользователя."""
+    normalize_profile(calculate_mean_mfcc([(bytes(80), "")]))
+
+def normalize_profile(vector: np.ndarray) -> np.ndarray:
+    """Приводит профиль к единичной норме, нулевой вектор остаётся нулевым."""
+    return normalize40(np.array(vector, dtype=np.float32))
+
+async def save_user_profile(session, user_id: int):
+    """Пересчитывает и сохраняет профиль пользователя в рамках переданной транзакции."""
+    tracks = (await session.execute(select_user_tracks(user_id))).fetchall()
+    profile = normalize_profile(calculate_mean_mfcc(tracks))
+    await session.execute(update(User).where(User.id == user_id).values(profile_vec=profile))
+
+BACKFILL_BATCH_SIZE = 200
+
+async def backfill_track_summaries():
+    """Досчитывает сводки MFCC для треков, загруженных до их появления, и пересчитывает профили владельцев.
+
+    Без этого старые треки (mfcc_mean IS NULL) молча выпадают из профиля. После первого прогона
+    таких строк не остаётся, и запрос при старте сразу возвращает пустой результат.
+    """
+    user_ids = set()
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                rows = (await session.execute(
+                    select(Track.id, Track.user_id, Track.mfcc)
+                    .where(Track.id > last_id, Track.mfcc_mean.is_(None), Track.mfcc.is_not(None))
+                    .order_by(Track.id)
+                    .limit(BACKFILL_BATCH_SIZE)
+                )).fetchall()
+                if not rows:
+                    break
+                for track_id, user_id, blob in rows:
+                    last_id = track_id
+                    if not blob or len(blob) % 80:  # Битый блоб: форму (20, n_frames) не восстановить
+                        continue
+                    mfcc = np.frombuffer(blob, dtype=np.float32).reshape(20, -1)
+                    mean, var = mfcc_summary(mfcc)
+                    await session.execute(
+                        update(Track).where(Track.id == track_id)
+                        .values(n_frames=mfcc.shape[1], mfcc_mean=mean.tobytes(), mfcc_var=var.tobytes())
+                    )
+                    user_ids.add(user_id)
+
+    for user_id in user_ids:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await save_user_profile(session, user_id)
+
+# <#> в pgvector — отрицательное скалярное произведение; для профилей единичной нормы это косинус
+MATCH_QUERY = text(
+    "SELECT -(u1.profile_vec <#> u2.profile_vec) FROM users u1, users u2 WHERE u1.id = :a AND u2.id = :b"
+)
 
 async def match_users(user1_id: int, user2_id: int):
-    """Сравниваем музыкальные вкусы двух пользователей."""
-    vec1 = calculate_mean_mfcc(await get_user_tracks(user1_id))
-    vec2 = calculate_mean_mfcc(await get_user_tracks(user2_id))
-    return max(0, cosine_similarity([vec1], [vec2])[0][0] * 100)
+    """Сравниваем музыкальные вкусы двух пользователей прямо в Postgres."""
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            params = {"a": user1_id, "b": user2_id}
+            similarity = (await session.execute(MATCH_QUERY, params)).scalar()
+            if similarity is None:  # Профиль ещё не сохранён (треки загружены до его появления)
+                for user_id in (user1_id, user2_id):
+                    await save_user_profile(session, user_id)
+                similarity = (await session.execute(MATCH_QUERY, params)).scalar()
+    return max(0, (similarity or 0) * 100)
 
 @router.message(Command("match"))
 async def handle_match(message: Message):
@@ -81,14 +145,15 @@ async def handle_match(message: Message):
     if len(args) != 2 or not args[1].startswith("@"):
         return await message.reply("Используй: `/match @username`")
 
-    sender = await get_user_by_chat_id(message.from_user.id)
-    receiver = await get_user_by_username(args[1][1:])
+    receiver_username = args[1][1:]
+    sender_id = await get_user_id_by_chat_id(message.from_user.id)
+    receiver_id = await get_user_id_by_username(receiver_username)
 
-    if not sender or not receiver:
+    if sender_id is None or receiver_id is None:
         return await message.reply("❌ Пользователь не найден или не зарегистрирован.")
 
-    similarity = await match_users(sender.id, receiver.id)
-    await message.reply(f"🎵 Твой музыкальный мэтч с @{receiver.username}: {similarity:.2f}%")
+    similarity = await match_users(sender_id, receiver_id)
+    await message.reply(f"🎵 Твой музыкальный мэтч с @{receiver_username}: {similarity:.2f}%")
 
 @router.message(CommandStart())
 @router.callback_query(F.data == "main_page")
@@ -104,13 +169,12 @@ async def start(msg: Message | CallbackQuery):
         await msg.answer(text, reply_markup=buttons)
 
 @router.message(F.text)
-async def handle_download(msg: Message):
+async def handle_download(msg: Message, sdk: YandexMusicSDK):
     """Поиск и отправка информации о треке."""
-    async with YandexMusicSDK(token=config.access_token.get_secret_value(), upload_dir="downloads") as sdk:
-        tracks = await sdk.search_tracks(msg.text, count=1, download=False, lyrics=False)
-        if not tracks:
-            return await msg.answer("❌ Трек не найден.")
-
-        track = tracks[0]
-        await msg.answer(f"🎵 Найдено: {track.title} - {', '.join(track.artists)}",
-                         reply_markup=builders.inline_builder(["✔ Confirm"], [f"confirm:{track.title} - {', '.join(track.artists)}"]))
+    tracks = await sdk.search_tracks(msg.text, count=1, download=False, lyrics=False)
+    if not tracks:
+        return await msg.answer("❌ Трек не найден.")
+
+    track = tracks[0]
+    await msg.answer(f"🎵 Найдено: {track.title} - {track.artist_line}",
+                     reply_markup=builders.inline_builder(["✔ Confirm"], [f"confirm:{track.title} - {track.artist_line}"]))
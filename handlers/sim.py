@@ -0,0 +1,57 @@
+"""Сводки MFCC треков и numba-ядра для 40-мерного профиля: 20 средних + 20 дисперсий."""
+import math
+
+import numpy as np
+from numba import njit
+
+
+def mfcc_summary(mfcc: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Среднее и дисперсия MFCC (20, n_frames) по фреймам, редукции явно во float32."""
+    inv_n = np.float32(1.0 / mfcc.shape[1])
+    mean = np.add.reduce(mfcc, axis=1, dtype=np.float32) * inv_n
+    centered = mfcc - mean[:, None]
+    var = np.add.reduce(centered * centered, axis=1, dtype=np.float32) * inv_n
+    return mean, var
+
+
+@njit(cache=True, fastmath=True, boundscheck=False)
+def reduce_profile(means, artist_ids, n_artists):
+    """Один проход по трекам: суммы и суммы квадратов по артистам, затем среднее по артистам.
+
+    Вторая половина профиля — дисперсия средних MFCC треков внутри артиста (E[x²] − E[x]²),
+    как np.var в исходной версии: артист с одним треком даёт 0.
+    """
+    # Аккумуляторы во float64: E[x²] − E[x]² во float32 теряет точность на больших c0
+    sums = np.zeros((n_artists, 20), dtype=np.float64)
+    squares = np.zeros((n_artists, 20), dtype=np.float64)
+    counts = np.zeros(n_artists, dtype=np.float64)
+    for i in range(means.shape[0]):
+        artist = artist_ids[i]
+        counts[artist] += 1
+        for j in range(20):
+            x = np.float64(means[i, j])
+            sums[artist, j] += x
+            squares[artist, j] += x * x
+
+    profile = np.zeros(40, dtype=np.float32)
+    for artist in range(n_artists):
+        inv_count = 1.0 / counts[artist]
+        for j in range(20):
+            mean = sums[artist, j] * inv_count
+            var = squares[artist, j] * inv_count - mean * mean
+            profile[j] += mean / n_artists
+            profile[20 + j] += max(var, 0.0) / n_artists
+    return profile
+
+@njit(cache=True, fastmath=True, boundscheck=False)
+def normalize40(profile):
+    """Нормирует профиль на месте: норма и деление без промежуточных массивов."""
+    squares = 0.0
+    for i in range(40):
+        squares += profile[i] * profile[i]
+    if squares == 0.0:
+        return profile  # Нулевой профиль остаётся нулевым
+    inv_norm = 1.0 / (math.sqrt(squares) + 1e-12)
+    for i in range(40):
+        profile[i] *= inv_norm
+    return profile
@@ -1,21 +1,42 @@
 import asyncio
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 from aiogram import Bot, Dispatcher
 
+try:
+    import uvloop
+except ImportError:  # uvloop не собирается под Windows
+    uvloop = None
+
 from config_reader import config
 from handlers import cmds
 from callbacks import user_cb
 from keyboards.builders import inline_builder
-from orm.db import User, Track, AsyncSessionLocal, init_db, reset_database
+from orm.db import User, Track, AsyncSessionLocal, engine, init_db, reset_database
+from yandex import redis_client, sdk
 
 
 async def main() -> None:
     # Инициализация базы данных
     await init_db()
+    # Старые треки без сводок MFCC: досчитываем до старта, иначе они не попадут в профиль
+    await cmds.backfill_track_summaries()
+    # librosa грузит CPU, поэтому MFCC считаем в отдельных процессах.
+    # spawn, а не fork: воркеры стартуют при первой загрузке, когда в процессе уже есть потоки
+    # (getaddrinfo aiohttp/asyncpg, asyncio.to_thread), а fork многопоточного процесса может зависнуть
+    user_cb.mfcc_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+    )
+    cmds.warm_up()
     
     bot = Bot(config.BOT_TOKEN.get_secret_value())
     dp = Dispatcher()
+    # Один клиент Yandex Music на весь процесс; хендлеры получают его аргументом sdk
+    await sdk.__aenter__()
+    dp["sdk"] = sdk
 
     dp.include_routers(
         cmds.router,
@@ -32,8 +53,11 @@ async def main() -> None:
     try:
         await dp.start_polling(bot)
     finally:
-        # Закрываем соединение с базой перед завершением
-        await AsyncSessionLocal.close()
+        await sdk.__aexit__(None, None, None)
+        await redis_client.aclose()
+        user_cb.mfcc_pool.shutdown(cancel_futures=True)
+        # Закрываем пул соединений с базой перед завершением (SIGTERM aiogram тоже доводит до этого блока)
+        await engine.dispose()
 
 try:
     if __name__ == '__main__':
@@ -41,7 +65,11 @@ try:
                         format="%(asctime)s %(levelname)s %(message)s")
         logging.info("Bot activate!")
         print("run!")
-        asyncio.run(main())
+        # uvloop быстрее стандартного цикла событий на aiohttp/asyncpg нагрузке
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
 except KeyboardInterrupt:
     logging.info("Bot force stopped!")
     print('stop!')
@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from sqlalchemy import Column, Integer, LargeBinary, String, ForeignKey
+from sqlalchemy import BigInteger, Column, Index, Integer, LargeBinary, String, ForeignKey, text
+from pgvector.sqlalchemy import HALFVEC
 from config_reader import config
 from sqlalchemy.future import select
 
@@ -11,34 +12,78 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
+    # HNSW по скалярному произведению: профили единичной нормы, так что это косинус
+    __table_args__ = (
+        Index(
+            "ix_users_profile_halfvec", "profile_vec",
+            postgresql_using="hnsw", postgresql_ops={"profile_vec": "halfvec_ip_ops"},
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String, unique=True, nullable=False)
-    chat_id = Column(Integer, unique=True, nullable=False)
+    chat_id = Column(BigInteger, unique=True, nullable=False)  # id в Telegram уже не влезают в int32
+    # Профиль единичной нормы: среднее + дисперсия MFCC; float16 вдвое компактнее, а для косинуса точности хватает
+    profile_vec = Column(HALFVEC(40), nullable=True)
 
     tracks = relationship("Track", back_populates="user", cascade="all, delete-orphan")
 
 class Track(Base):
     __tablename__ = "tracks"
+    # Все выборки треков идут по user_id (а сводка профиля ещё и группирует по artist)
+    __table_args__ = (Index("ix_tracks_user_artist", "user_id", "artist"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String, nullable=False)
     artist = Column(String, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     mfcc = Column(LargeBinary, nullable=True)  # Новый столбец
+    n_frames = Column(Integer, nullable=True)  # Форма mfcc — (20, n_frames), без угадывания через reshape(20, -1)
+    mfcc_mean = Column(LargeBinary(80), nullable=True)  # float32[20]: среднее MFCC по фреймам
+    mfcc_var = Column(LargeBinary(80), nullable=True)  # float32[20]: дисперсия MFCC по фреймам (в профиль не входит)
 
     user = relationship("User", back_populates="tracks")
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=config.SQL_ECHO,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+)
 AsyncSessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# create_all не трогает уже существующие таблицы, поэтому новые столбцы добавляем вручную.
+# Каждый шаг идемпотентен и на уже обновлённой базе ничего не меняет
+SCHEMA_UPGRADES = [
+    # Однократно: ALTER ... TYPE переписывает таблицу под ACCESS EXCLUSIVE, поэтому только пока столбец ещё int4
+    """
+    DO $$ BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'users' AND column_name = 'chat_id') = 'integer' THEN
+            ALTER TABLE users ALTER COLUMN chat_id TYPE BIGINT;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_vec halfvec(40)",
+    "CREATE INDEX IF NOT EXISTS ix_users_profile_halfvec ON users USING hnsw (profile_vec halfvec_ip_ops)",
+    "ALTER TABLE tracks ADD COLUMN IF NOT EXISTS mfcc_mean BYTEA",
+    "ALTER TABLE tracks ADD COLUMN IF NOT EXISTS mfcc_var BYTEA",
+    "ALTER TABLE tracks ADD COLUMN IF NOT EXISTS n_frames INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_tracks_user_artist ON tracks (user_id, artist)",
+]
+
 async def init_db():
     async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))  # pgvector
         await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
 
 
 async def reset_database():
     async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))  # pgvector
         await conn.run_sync(Base.metadata.drop_all)  # Удаляет все таблицы
         await conn.run_sync(Base.metadata.create_all)  # Создает заново
 
@@ -2,20 +2,22 @@ import asyncio
 import logging
 import os
 import re
+import time
+import uuid
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional, Union, Literal
 
 
-import aiofiles
+import orjson
 from aiogram import Bot
-from aiogram.types import FSInputFile, InputMediaAudio, InputMediaPhoto
-from aiohttp import ClientSession
-from mutagen.id3 import ID3NoHeaderError
-from yandex_music import ClientAsync, Track, DownloadInfo
+from aiogram.types import BufferedInputFile, InputMediaAudio, InputMediaPhoto
+from aiohttp import ClientSession, TCPConnector
+from yandex_music import Album, ClientAsync, Track, DownloadInfo
 from yandex_music.exceptions import NotFoundError
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, ID3NoHeaderError, TALB, TCON, TDRC, TIT2, TLEN, TPE1
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
 
 from config_reader import config
@@ -25,15 +27,28 @@ ADMIN_ID = ''
 # Configuration Constants
 CODEC = "mp3"
 DEFAULT_BITRATE = 320
-YTRACK_URL_PATTERN = re.compile(r"https://music\.yandex\.(?:ru|com|kz)/album/\d+/track/\d+")
-YALBUM_URL_PATTERN = re.compile(r"https://music\.yandex\.(?:ru|com|kz)/album/\d+")
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+WRITE_BATCH_SIZE = 1024 * 1024  # Bytes buffered per thread-offloaded file write
+FILE_ID_TTL = 30 * 24 * 3600  # Telegram file_id for an uploaded track
+TRACK_CACHE_TTL = 24 * 3600  # TrackData metadata
+OBJECT_CACHE_TTL = 600  # In-process Track/Album objects
+OBJECT_CACHE_SIZE = 1024
+# Spaces and characters that are unsafe in filenames all become "_"
+_FILENAME_TRANS = str.maketrans({c: "_" for c in ' /\\:*?"<>|'})
+YANDEX_URL_PREFIX = "https://music.yandex."
+# URLs are pure ASCII: re.ASCII keeps \d on the fast path; used with fullmatch
+YTRACK_URL_PATTERN = re.compile(r"https://music\.yandex\.(?:ru|com|kz)/album/\d+/track/\d+", re.ASCII)
+YALBUM_URL_PATTERN = re.compile(r"https://music\.yandex\.(?:ru|com|kz)/album/\d+", re.ASCII)
 CHART_COUNTRIES = Literal[
     'world', 'kazakhstan', 'russia', 'armenia', 'georgia', 'azerbaijan',
     'kyrgyzstan', 'moldova', 'tajikistan', 'turkmenistan', 'uzbekistan'
 ]
 
+logger = logging.getLogger(__name__)
+redis_client = Redis.from_url(config.REDIS_URL)
+
 # Data Models
-@dataclass
+@dataclass(slots=True)
 class TrackData:
     """Represents metadata for a single track."""
     id: str
@@ -50,9 +65,16 @@ class TrackData:
     chart_progress: Optional[str] = None
     chart_shift: Optional[int] = None
     file_path: Optional[str] = None
+    audio: Optional[bytes] = None  # MP3 bytes when downloaded with in_memory=True
+    artist_line: str = ""  # ", ".join(artists), built once for captions and tags
+
+    def __post_init__(self) -> None:
+        # Also covers TrackData restored from a cache entry written before artist_line existed
+        if not self.artist_line:
+            self.artist_line = ", ".join(self.artists)
 
 
-@dataclass
+@dataclass(slots=True)
 class AlbumData:
     id: int
     title: str
@@ -66,31 +88,45 @@ class AlbumData:
 class YandexMusicSDK:
     """A senior-level SDK for interacting with the Yandex Music API."""
 
-    def __init__(self, token: str, upload_dir: Optional[str] = None):
+    def __init__(
+        self, token: str, upload_dir: Optional[str] = None, cache: Optional[Redis] = None, concurrency: int = 8
+    ):
         """
         Initialize the SDK with a required token and optional upload directory.
 
         Args:
             token (str): Yandex Music API token.
             upload_dir (Optional[str]): Directory for downloaded files. Defaults to current working directory.
+            cache (Optional[Redis]): Redis client for caching track metadata. Defaults to no caching.
+            concurrency (int): Maximum number of tracks processed at once. Defaults to 8.
         """
+        self.cache = cache
+        self.concurrency = concurrency
+        self._sem = asyncio.Semaphore(concurrency)
+        self._track_cache: dict[str, tuple[float, Track]] = {}
+        self._album_cache: dict[int, tuple[float, Album]] = {}
+        self._inflight: dict[tuple[str, bool], asyncio.Future] = {}
         self.client = ClientAsync(token=token)
         self.upload_dir = Path(upload_dir) if upload_dir else Path.cwd()
         self.upload_dir.mkdir(parents=True, exist_ok=True)
         self.logger = logging.getLogger(__name__)
+        self._session: Optional[ClientSession] = None
 
     async def __aenter__(self) -> 'YandexMusicSDK':
-        """Initialize the client asynchronously."""
+        """Initialize the client and the shared HTTP session asynchronously."""
         await self.client.init()
+        self._get_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
         """Clean up resources on exit."""
-        pass  # ClientAsync handles its own cleanup
+        if self._session is not None:  # ClientAsync handles its own cleanup
+            await self._session.close()
+            self._session = None
 
     # Public Methods
     async def search_tracks(
-        self, query: str, count: int = 10, download: bool = False, lyrics: bool = False
+        self, query: str, count: int = 10, download: bool = False, lyrics: bool = False, in_memory: bool = False
     ) -> List[TrackData]:
         """
         Search for tracks with optional downloading and lyrics retrieval.
@@ -100,6 +136,7 @@ class YandexMusicSDK:
             count (int): Number of tracks to return. Defaults to 10.
             download (bool): Whether to download tracks. Defaults to False.
             lyrics (bool): Whether to fetch lyrics. Defaults to False.
+            in_memory (bool): Keep downloads in TrackData.audio instead of writing them to upload_dir. Defaults to False.
 
         Returns:
             List[TrackData]: List of track metadata.
@@ -110,12 +147,12 @@ class YandexMusicSDK:
             return []
 
         tracks = search_result.tracks.results[:count]
-        tasks = [self._process_track(track, download, lyrics) for track in tracks]
+        tasks = [self._process_track(track, download, lyrics, in_memory) for track in tracks]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         return [r for r in results if r and not isinstance(r, Exception)]
 
     async def get_track(
-        self, track_id: Union[str, int], download: bool = False, lyrics: bool = False
+        self, track_id: Union[str, int], download: bool = False, lyrics: bool = False, in_memory: bool = False
     ) -> Optional[TrackData]:
         """
         Retrieve metadata for a specific track by ID or URL.
@@ -124,6 +161,7 @@ class YandexMusicSDK:
             track_id (Union[str, int]): Track ID or URL.
             download (bool): Whether to download the track. Defaults to False.
             lyrics (bool): Whether to fetch lyrics. Defaults to False.
+            in_memory (bool): Keep the download in TrackData.audio instead of writing it to upload_dir. Defaults to False.
 
         Returns:
             Optional[TrackData]: Track metadata or None if not found.
@@ -133,11 +171,28 @@ class YandexMusicSDK:
             self.logger.error("Invalid track ID or URL")
             return None
 
-        tracks = await self.client.tracks([track_id])
-        if not tracks:
-            self.logger.error(f"Track {track_id} not found")
-            return None
-        return await self._process_track(tracks[0], download, lyrics)
+        # Only metadata-only lookups are cached: downloads always need fresh direct links
+        use_cache = self.cache is not None and not download
+        cache_key = f"ym:track:{track_id}"
+        if use_cache:
+            cached = await _cache_get(self.cache, cache_key)
+            if cached:
+                track_data = TrackData(**orjson.loads(cached))
+                if not lyrics or track_data.lyrics is not None:
+                    return track_data
+
+        track = self._cache_lookup(self._track_cache, track_id)
+        if track is None:
+            tracks = await self.client.tracks([track_id])
+            if not tracks:
+                self.logger.error(f"Track {track_id} not found")
+                return None
+            track = self._cache_store(self._track_cache, track_id, tracks[0])
+        track_data = await self._process_track(track, download, lyrics, in_memory)
+        if use_cache and track_data:
+            # orjson serializes dataclasses natively, without the asdict() copy
+            await _cache_set(self.cache, cache_key, orjson.dumps(track_data), TRACK_CACHE_TTL)
+        return track_data
 
     async def get_currently_playing(self, device: str, lyrics: bool = False) -> Optional[TrackData]:
         """
@@ -177,23 +232,27 @@ class YandexMusicSDK:
             self.logger.error("Invalid album ID or URL")
             return None
 
-        album = await self.client.albums_with_tracks(album_id)
-        if not album:
-            self.logger.error(f"Album {album_id} not found")
-            return None
+        album = self._cache_lookup(self._album_cache, album_id)
+        if album is None:
+            album = await self.client.albums_with_tracks(album_id)
+            if not album:
+                self.logger.error(f"Album {album_id} not found")
+                return None
+            self._cache_store(self._album_cache, album_id, album)
 
-        tracks = [
-            await self._process_track(track, download=False, lyrics=False)
+        tasks = [
+            self._process_track(track, download=False, lyrics=False)
             for volume in album.volumes
             for track in volume
         ]
+        tracks = await asyncio.gather(*tasks, return_exceptions=True)
         return AlbumData(
             id=album.id,
             title=album.title,
             genre=album.genre,
             year=album.year,
             track_count=album.track_count,
-            tracks=[t for t in tracks if t],
+            tracks=[t for t in tracks if t and not isinstance(t, Exception)],
             cover_url=album.get_cover_url('1000x1000') if album.cover_uri else None
         )
 
@@ -216,12 +275,14 @@ class YandexMusicSDK:
             self.logger.error(f"No chart data for {country}")
             return None
 
+        chart_tracks = chart.chart.tracks[:count]
+        tasks = [self._process_track(track_short.track, download, lyrics=False) for track_short in chart_tracks]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
         tracks = []
-        for track_short in chart.chart.tracks[:count]:
-            track = track_short.track
+        for track_short, track_data in zip(chart_tracks, results):
             chart_info = track_short.chart
-            track_data = await self._process_track(track, download, lyrics=False)
-            if track_data:
+            if track_data and not isinstance(track_data, Exception):
                 track_data.chart_position = chart_info.position
                 track_data.chart_progress = chart_info.progress
                 track_data.chart_shift = chart_info.shift
@@ -229,38 +290,106 @@ class YandexMusicSDK:
         return tracks
 
     # Private Helper Methods
-    async def _process_track(self, track: Track, download: bool, lyrics: bool) -> Optional[TrackData]:
-        """Process a track to extract metadata, optionally download, and fetch lyrics."""
-        try:
-            album = track.albums[0] if track.albums else None
-            download_info = await track.get_download_info_async(get_direct_links=True)
-            lyrics_text = await self._get_lyrics(track) if lyrics else None
-
-            track_data = TrackData(
-                id=str(track.id),
-                title=track.title,
-                artists=[a.name for a in track.artists],
-                duration=track.duration_ms / 1000.0,
-                album_id=str(album.id) if album else None,
-                album_title=album.title if album else None,
-                genre=album.genre if album else None,
-                year=album.year if album else None,
-                cover_url=track.get_cover_url('1000x1000') if track.cover_uri else None,
-                lyrics=lyrics_text
+    @staticmethod
+    def _cache_lookup(cache: dict, key):
+        """Return a cached API object if it is still fresh, otherwise None."""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > OBJECT_CACHE_TTL:
+            del cache[key]
+            return None
+        return value
 
+    @staticmethod
+    def _cache_store(cache: dict, key, value):
+        """Cache an API object, evicting the oldest entry when the cache is full."""
+        cache.pop(key, None)
+        if len(cache) >= OBJECT_CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = (time.monotonic(), value)
+        return value
+
+    def _get_session(self) -> ClientSession:
+        """Return the shared HTTP session, creating it on first use if the SDK was not entered."""
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.concurrency * 2,
+                    limit_per_host=self.concurrency,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                )
             )
+        return self._session
 
-            if download:
-                filename = self._generate_filename(track)
-                file_path = await self._download_track(download_info, filename)
-                if file_path:
-                    self._insert_metadata(track_data, file_path)
-                    track_data.file_path = file_path
+    async def _process_track(
+        self, track: Track, download: bool, lyrics: bool, in_memory: bool = False
+    ) -> Optional[TrackData]:
+        """Process a track to extract metadata, optionally download, and fetch lyrics."""
+        async with self._sem:  # Bound in-flight API calls and downloads
+            try:
+                album = track.albums[0] if track.albums else None
+                track_data = TrackData(
+                    id=str(track.id),
+                    title=track.title,
+                    artists=[a.name for a in track.artists],
+                    duration=track.duration_ms / 1000.0,
+                    album_id=str(album.id) if album else None,
+                    album_title=album.title if album else None,
+                    genre=album.genre if album else None,
+                    year=album.year if album else None,
+                    cover_url=track.get_cover_url('1000x1000') if track.cover_uri else None
+                )
 
-            return track_data
-        except Exception as e:
-            self.logger.error(f"Failed to process track {track.id}: {e}")
-            return None
+                # Download info is only needed for downloads; when lyrics are also requested,
+                # the two independent round-trips run concurrently
+                downloaded = None
+                if download and lyrics:
+                    downloaded, track_data.lyrics = await asyncio.gather(
+                        self._get_audio(track, track_data, in_memory), self._get_lyrics(track)
+                    )
+                elif download:
+                    downloaded = await self._get_audio(track, track_data, in_memory)
+                elif lyrics:
+                    track_data.lyrics = await self._get_lyrics(track)
+
+                if in_memory:
+                    track_data.audio = downloaded
+                else:
+                    track_data.file_path = downloaded
+
+                return track_data
+            except Exception as e:
+                self.logger.error(f"Failed to process track {track.id}: {e}")
+                return None
+
+    async def _get_audio(self, track: Track, track_data: TrackData, in_memory: bool) -> Union[bytes, str, None]:
+        """Download a track once, sharing the result with concurrent requests for the same track."""
+        key = (track_data.id, in_memory)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Shield so a cancelled waiter doesn't cancel the download other requests are waiting on
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        result = None
+        try:
+            download_info = await track.get_download_info_async(get_direct_links=True)
+            if in_memory:
+                result = await self._fetch_track(download_info)
+            else:
+                result = await self._download_track(download_info, self._generate_filename(track))
+                if result:
+                    # mutagen does blocking file I/O: keep it off the event loop
+                    await asyncio.to_thread(self._insert_metadata, track_data, result)
+            return result
+        finally:
+            # Waiters get None on failure; the error itself is logged once by the request that owned the download
+            del self._inflight[key]
+            pending.set_result(result)
 
     async def _get_lyrics(self, track: Track) -> Optional[str]:
         """Fetch lyrics for a track."""
@@ -276,19 +405,41 @@ class YandexMusicSDK:
 
     def _generate_filename(self, track: Track) -> str:
         """Generate a sanitized, descriptive filename for a track."""
-        artist = "_".join(a.name for a in track.artists).replace("/", "_").replace(" ", "_")
-        title = track.title.replace("/", "_").replace(" ", "_")
-
-        safe_name = re.sub(r'[\\/:*?"<>|]', '_', f"{artist}-{title}")
+        artist = "_".join(a.name for a in track.artists)
+        safe_name = f"{artist}-{track.title}".translate(_FILENAME_TRANS)
         return f"{safe_name}.{CODEC}"
 
+    def _best_mp3_info(self, download_info: List[DownloadInfo]) -> Optional[DownloadInfo]:
+        """Pick the highest-bitrate MP3 download option."""
+        # One pass that filters and keeps the best, no intermediate list or key lambda
+        best_info, best_bitrate = None, -1
+        for info in download_info:
+            if info.codec != 'mp3':
+                continue
+            bitrate = info.bitrate_in_kbps or DEFAULT_BITRATE
+            if bitrate > best_bitrate:
+                best_info, best_bitrate = info, bitrate
+        if best_info is None:
+            self.logger.error("No MP3 download available")
+        return best_info
+
+    async def _fetch_track(self, download_info: List[DownloadInfo]) -> Optional[bytes]:
+        """Download a track into memory using the best available quality."""
+        best_info = self._best_mp3_info(download_info)
+        if not best_info:
+            return None
+
+        async with self._get_session().get(best_info.direct_link) as response:
+            if response.status == 200:
+                return await response.read()
+            self.logger.error(f"Download failed for {best_info.direct_link}: HTTP {response.status}")
+            return None
+
     async def _download_track(self, download_info: List[DownloadInfo], filename: str) -> Optional[str]:
         """Download a track using the best available quality."""
-        mp3_infos = [info for info in download_info if info.codec == 'mp3']
-        if not mp3_infos:
-            self.logger.error("No MP3 download available")
+        best_info = self._best_mp3_info(download_info)
+        if not best_info:
             return None
-        best_info = max(mp3_infos, key=lambda x: x.bitrate_in_kbps or DEFAULT_BITRATE)
         download_url = best_info.direct_link
         file_path = self.upload_dir / filename
 
@@ -296,38 +447,53 @@ class YandexMusicSDK:
             self.logger.info(f"Track {filename} already exists at {file_path}")
             return str(file_path)
 
-        async with ClientSession() as session:
-            async with session.get(download_url) as response:
-                if response.status == 200:
-                    async with aiofiles.open(file_path, 'wb') as f:
-                        await f.write(await response.read())
-                    self.logger.info(f"Downloaded track to {file_path}")
-                    return str(file_path)
-                self.logger.error(f"Download failed for {filename}: HTTP {response.status}")
-                return None
+        # Stream into a private .part file and rename it into place, so readers never see a partial track
+        part_path = file_path.with_name(f"{file_path.name}.{uuid.uuid4().hex[:8]}.part")
+        try:
+            async with self._get_session().get(download_url) as response:
+                if response.status != 200:
+                    self.logger.error(f"Download failed for {filename}: HTTP {response.status}")
+                    return None
+                # Batch network chunks into ~1 MiB writes: one thread dispatch per batch instead of per chunk
+                f = await asyncio.to_thread(open, part_path, 'wb')
+                try:
+                    buffer = bytearray()
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        buffer += chunk
+                        if len(buffer) >= WRITE_BATCH_SIZE:
+                            await asyncio.to_thread(f.write, buffer)
+                            buffer.clear()
+                    if buffer:
+                        await asyncio.to_thread(f.write, buffer)
+                finally:
+                    await asyncio.to_thread(f.close)
+            os.replace(part_path, file_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+
+        self.logger.info(f"Downloaded track to {file_path}")
+        return str(file_path)
 
     def _insert_metadata(self, track_data: TrackData, file_path: str) -> None:
         """Insert metadata into a downloaded MP3 file."""
         try:
+            # Only the ID3 header is parsed (no MPEG frame scan); files without a tag get a fresh one
             try:
-                audio = EasyID3(file_path)
+                tags = ID3(file_path)
             except ID3NoHeaderError:
-                audio = MP3(file_path)
-                audio.add_tags()
-                audio.save()
-                audio = EasyID3(file_path)
+                tags = ID3()
 
-            audio['title'] = track_data.title
-            audio['artist'] = ", ".join(track_data.artists)
+            tags.setall('TIT2', [TIT2(encoding=3, text=track_data.title)])
+            tags.setall('TPE1', [TPE1(encoding=3, text=track_data.artist_line)])
             if track_data.album_title:
-                audio['album'] = track_data.album_title
+                tags.setall('TALB', [TALB(encoding=3, text=track_data.album_title)])
             if track_data.year:
-                audio['date'] = str(track_data.year)
+                tags.setall('TDRC', [TDRC(encoding=3, text=str(track_data.year))])
             if track_data.genre:
-                audio['genre'] = track_data.genre
+                tags.setall('TCON', [TCON(encoding=3, text=track_data.genre)])
             if track_data.duration:
-                audio['length'] = str(int(track_data.duration * 1000))
-            audio.save()
+                tags.setall('TLEN', [TLEN(encoding=3, text=str(int(track_data.duration * 1000)))])
+            tags.save(file_path)
             self.logger.debug(f"Metadata inserted for {file_path}")
         except Exception as e:
             self.logger.error(f"Failed to insert metadata for {file_path}: {e}")
@@ -335,11 +501,12 @@ class YandexMusicSDK:
     @staticmethod
     async def _extract_track_id(track: Union[str, int]) -> Optional[str]:
         """Extract track ID from a URL or direct ID."""
-        if YTRACK_URL_PATTERN.match(track):
-            # Extract the track ID from the URL (last segment after '/')
-            return track.split('/')[-1]
-        elif track.isdigit():
+        if track.isdigit():
             return track  # Return as-is if it's a numeric ID
+        # Cheap prefix test first; the regex only runs on strings that look like Yandex URLs
+        if track.startswith(YANDEX_URL_PREFIX) and "/track/" in track and YTRACK_URL_PATTERN.fullmatch(track):
+            # Extract the track ID from the URL (last segment after '/')
+            return track[track.rfind('/') + 1:]
         return None
 
     @staticmethod
@@ -347,60 +514,100 @@ class YandexMusicSDK:
         """Extract album ID from a URL."""
         if album.isdigit():
             return int(album)  # Directly return numeric ID
-        match = YALBUM_URL_PATTERN.match(album)
-        if match:
+        if album.startswith(YANDEX_URL_PREFIX) and YALBUM_URL_PATTERN.fullmatch(album):
             # Extract the album ID from the URL (last segment after '/')
-            return int(album.split('/')[-1])
+            return int(album[album.rfind('/') + 1:])
         return None  # Return None if neither a URL nor a numeric ID
 
+# One SDK per process, shared by the bot handlers and the inline flow below.
+# Enter it once at startup (`await sdk.__aenter__()`) so client.init() runs a single time.
+sdk = YandexMusicSDK(token=YANDEX_TOKEN, upload_dir="./downloads", cache=redis_client)
+
+
+async def _cache_get(cache: Redis, key: str) -> Optional[bytes]:
+    """Read a cache entry; Redis outages degrade to a cache miss."""
+    try:
+        return await cache.get(key)
+    except RedisError as e:
+        logger.warning(f"Cache read failed for {key}: {e}")
+        return None
+
+
+async def _cache_set(cache: Redis, key: str, value: Union[str, bytes], ttl: int) -> None:
+    """Write a cache entry; Redis outages are logged and ignored."""
+    try:
+        await cache.set(key, value, ex=ttl)
+    except RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {e}")
+
+
 class YANDEX_MUSIC_TRACK_CAPTION:
     def __init__(self, track):
         self.track = track
+        self._text: Optional[str] = None
 
     def format(self) -> str:
-        return (
-            f"<b>🎵 Track:</b> <a href='https://music.yandex.com/album/{self.track.album_id}/track/{self.track.id}'>"
-            f"{self.track.title}</a> • {self.track.year}\n"
-            f"<b>👥 Artists:</b> <i>{', '.join(a for a in self.track.artists)}</i>\n"
-            f"<b>📀 Album:</b> <a href='https://music.yandex.com/album/{self.track.album_id}'>"
-            f"{self.track.album_title}</a>\n"
-            f"<b>🎶 Genre:</b> <i>{self.track.genre.capitalize()}</i>\n"
-            f"<b>⏱️ Duration:</b> <code>{int(self.track.duration // 60)}:{int(self.track.duration % 60):02d}</code>"
-        )
+        # TrackData does not change after creation, so the caption is built once per instance
+        if self._text is None:
+            track = self.track
+            album_url = f"https://music.yandex.com/album/{track.album_id}"
+            minutes, seconds = divmod(int(track.duration), 60)
+            self._text = (
+                f"<b>🎵 Track:</b> <a href='{album_url}/track/{track.id}'>{track.title}</a> • {track.year}\n"
+                f"<b>👥 Artists:</b> <i>{track.artist_line}</i>\n"
+                f"<b>📀 Album:</b> <a href='{album_url}'>{track.album_title}</a>\n"
+                f"<b>🎶 Genre:</b> <i>{track.genre.capitalize()}</i>\n"
+                f"<b>⏱️ Duration:</b> <code>{minutes}:{seconds:02d}</code>"
+            )
+        return self._text
+
+
+def _audio_caption(track: TrackData) -> str:
+    """Caption for an inline audio message."""
+    return (
+        f"{track.artist_line} - {track.title}\n"
+        f"🔗 <a href='https://music.yandex.com/album/{track.album_id}/track/{track.id}'>Yandex Music</a>"
+    )
 
 
 async def download_and_replace_yandex(track, inline_message_id, bot: Bot):
     """Download a Yandex Music track and replace the inline message with the audio."""
-    file_path = None
+    file_id_key = f"ym:fid:{track.id}"
     try:
-        async with YandexMusicSDK(token=YANDEX_TOKEN, upload_dir="./downloads") as ym:
-            # Download the track using its ID
-            track = await ym.get_track(track.id, download=True)
-            if not track:
-                raise FileNotFoundError("Failed to download track")
-
-            file_path = track.file_path
-            audio_input = FSInputFile(file_path)
-
-            # Upload the audio to a media chat to get a file_id
-            # Replace MEDIA_CHAT_ID with your bot's chat ID or a dedicated channel ID
-            msg = await bot.send_audio(
-                chat_id=ADMIN_ID,  # Define this constant or use bot.get_me() ID
-                audio=audio_input,
-                title=track.title,
-                performer=", ".join(track.artists)
-            )
-            file_id = msg.audio.file_id
-
-            # Edit the inline message with the actual audio
+        # A track uploaded before already has a Telegram file_id: skip download and upload entirely
+        cached_file_id = await _cache_get(redis_client, file_id_key)
+        if cached_file_id:
             await bot.edit_message_media(
                 inline_message_id=inline_message_id,
-                media=InputMediaAudio(
-                    media=file_id,
-                    caption=f"{', '.join(track.artists)} - {track.title}\n🔗 <a href='https://music.yandex.com/album/{track.album_id}/track/{track.id}'>Yandex Music</a>",
-                    parse_mode="HTML"
-                )
+                media=InputMediaAudio(media=cached_file_id.decode(), caption=_audio_caption(track), parse_mode="HTML")
             )
+            return
+
+        # Download the track into memory: bytes go from Yandex to Telegram without touching the disk
+        # (kept in a separate name so the error branch can still use the original track's cover)
+        downloaded = await sdk.get_track(track.id, download=True, in_memory=True)
+        if not downloaded or not downloaded.audio:
+            raise FileNotFoundError("Failed to download track")
+        track = downloaded
+
+        audio_input = BufferedInputFile(track.audio, filename=f"{track.id}.{CODEC}")
+
+        # Upload the audio to a media chat to get a file_id
+        # Replace MEDIA_CHAT_ID with your bot's chat ID or a dedicated channel ID
+        msg = await bot.send_audio(
+            chat_id=ADMIN_ID,  # Define this constant or use bot.get_me() ID
+            audio=audio_input,
+            title=track.title,
+            performer=track.artist_line
+        )
+        file_id = msg.audio.file_id
+        await _cache_set(redis_client, file_id_key, file_id, FILE_ID_TTL)
+
+        # Edit the inline message with the actual audio
+        await bot.edit_message_media(
+            inline_message_id=inline_message_id,
+            media=InputMediaAudio(media=file_id, caption=_audio_caption(track), parse_mode="HTML")
+        )
     except Exception as e:
         #logger.error(f"Error downloading Yandex Music track: {e}")
         # On error, replace with an error message and cover image
@@ -411,13 +618,6 @@ async def download_and_replace_yandex(track, inline_message_id, bot: Bot):
                 caption="❌ Error downloading track"
             )
         )
-    finally:
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                #logger.error(f"Failed to remove temporary file {file_path}: {e}")
-                print(f"Failed to remove temporary file {file_path}: {e}")
 # #Example Usage
 # async def main():
 #     # Configure logging